@@ -1,7 +1,184 @@
 import streamlit as st
 import pandas as pd
+import hashlib
+import io
 import os
+import re
 import numpy as np
+from streamlit.runtime.uploaded_file_manager import UploadedFile
+
+# Column names containing any of these terms are treated as compensation
+COMP_TERMS = ('Salary', 'Bonus', 'Benefits', 'Stock', 'Retirement', 'Compensation')
+COMP_RE = re.compile("|".join(COMP_TERMS), re.IGNORECASE)
+
+# Columns containing any of these names are coerced to numbers on upload
+NUMERIC_COLUMNS = (
+    'Base Salary', 'Annual Bonus', 'Benefits',
+    'Stock Options', 'Retirement Contribution', 'Total Compensation'
+)
+NUMERIC_RE = re.compile("|".join(map(re.escape, NUMERIC_COLUMNS)))
+
+# Currency symbols, thousands separators, whitespace and accounting parentheses
+AMOUNT_NOISE_RE = re.compile(r'[$€£¥,\s()]')
+# First (optionally signed) number in a cell, once the noise above is removed
+AMOUNT_RE = re.compile(r'(-?\d+\.?\d*)')
+# Accounting notation for negative amounts, e.g. "($1,200)"
+NEGATIVE_RE = re.compile(r'^\(.*\)$')
+
+# Default number of rows rendered in data previews
+PREVIEW_ROWS = 500
+
+
+def matching_columns(df: pd.DataFrame, pattern: re.Pattern = COMP_RE) -> list:
+    """Return the columns whose name matches pattern, in frame order."""
+    # Cast labels to str so non-string headers (e.g. ints from Excel) still work
+    return df.columns[df.columns.astype(str).str.contains(pattern)].tolist()
+
+
+def file_digest(f: UploadedFile) -> str:
+    """Hash an uploaded file in 64 KB chunks without copying the whole payload."""
+    h = hashlib.blake2b(digest_size=16)
+    pos = f.tell()
+    f.seek(0)
+    for chunk in iter(lambda: f.read(65536), b""):
+        h.update(chunk)
+    f.seek(pos)
+    return h.hexdigest()
+
+
+def parse_amounts(s: pd.Series) -> pd.Series:
+    """Extract numbers from currency-formatted text such as "$75,000.00".
+
+    Currency symbols, separators and whitespace are dropped so a leading
+    minus ("-$500") stays attached to the digits, and amounts wrapped in
+    parentheses ("($1,200)") are treated as negative. Cells without a number
+    become missing.
+    """
+    text = s.astype("string").str.strip()
+    negative = text.str.contains(NEGATIVE_RE).fillna(False)
+    amounts = text.str.replace(AMOUNT_NOISE_RE, "", regex=True).str.extract(AMOUNT_RE, expand=False)
+    return amounts.mask(negative, "-" + amounts.str.lstrip("-"))
+
+
+def to_amounts(s: pd.Series) -> pd.Series:
+    """Convert a text column to float64 amounts.
+
+    Plain numbers (including forms like "1.5e5") go through pd.to_numeric;
+    only the cells it cannot read are handed to parse_amounts.
+    """
+    numbers = pd.to_numeric(s.astype("string"), errors='coerce').astype("float64")
+    failed = numbers.isna() & s.notna()
+    if failed.any():
+        numbers.loc[failed] = pd.to_numeric(parse_amounts(s[failed]), errors='coerce').astype("float64")
+    return numbers
+
+
+@st.cache_data(show_spinner=False, max_entries=32, ttl=3600,
+               hash_funcs={UploadedFile: file_digest})
+def load_df(uploaded_file: UploadedFile, ext: str) -> pd.DataFrame:
+    """Parse an uploaded file and coerce the known numeric columns."""
+    uploaded_file.seek(0)
+    # Arrow-backed dtypes keep ID/name columns out of Python objects, which makes
+    # the later concat and groupby considerably cheaper
+    if ext == ".csv":
+        df = pd.read_csv(uploaded_file, engine="pyarrow", dtype_backend="pyarrow")
+    else:  # Excel file
+        df = pd.read_excel(uploaded_file, engine="calamine", dtype_backend="pyarrow")
+
+    # Process numeric columns
+    cols = matching_columns(df, NUMERIC_RE)
+    # Only text columns need currency formatting stripped and parsing; columns the
+    # reader already typed as numbers go straight to the float64 conversion
+    text_cols = [col for col in cols if not pd.api.types.is_numeric_dtype(df[col])]
+    if text_cols:
+        df[text_cols] = df[text_cols].apply(to_amounts)
+    if cols:
+        values = df[cols].to_numpy(dtype=np.float64, na_value=np.nan)
+        values[np.isnan(values)] = 0
+        df[cols] = values
+
+    # Cast once here so the department groupby reuses integer codes on every rerun
+    if 'Department' in df.columns:
+        df['Department'] = df['Department'].astype('category')
+
+    return df
+
+
+@st.cache_data(show_spinner=False, max_entries=8, ttl=3600)
+def combine_sources(dfs: tuple) -> tuple:
+    """Concatenate the uploaded sources on their common columns.
+
+    Returns the combined frame and whether any columns had to be dropped.
+    """
+    # Common columns, in the order they appear in the first source
+    common = dfs[0].columns
+    for df in dfs[1:]:
+        common = common.intersection(df.columns, sort=False)
+    mismatched = any(len(df.columns) != len(common) for df in dfs)
+
+    # Let concat align the columns instead of reindexing each source first
+    combined = pd.concat(dfs, join="inner", ignore_index=True, copy=False)
+    # Categoricals with different categories concatenate to plain strings
+    if 'Department' in combined.columns:
+        combined['Department'] = combined['Department'].astype('category')
+    return combined[common], mismatched
+
+
+@st.cache_data(show_spinner=False, max_entries=2)
+def to_csv_bytes(df: pd.DataFrame) -> bytes:
+    """Serialize a frame to CSV for download."""
+    # Write bytes directly instead of building a str and encoding it afterwards
+    buffer = io.BytesIO()
+    df.to_csv(buffer, index=False, encoding="utf-8")
+    return buffer.getvalue()
+
+
+@st.cache_data(show_spinner=False, max_entries=2)
+def to_parquet_bytes(df: pd.DataFrame) -> bytes:
+    """Serialize a frame to zstd-compressed Parquet for download."""
+    # Parquet requires string column names
+    df = df.set_axis(df.columns.astype(str), axis=1, copy=False)
+    # Sources with different column types combine into object columns holding
+    # mixed values (e.g. 1 and "E001"), which Arrow cannot give a single type;
+    # write those, and categoricals with such categories, as strings
+    mixed = {
+        col: "string" for col, dtype in df.dtypes.items()
+        if dtype == object
+        or (isinstance(dtype, pd.CategoricalDtype) and dtype.categories.dtype == object)
+    }
+    if mixed:
+        df = df.astype(mixed, copy=False)
+    buffer = io.BytesIO()
+    df.to_parquet(buffer, engine="pyarrow", compression="zstd", index=False)
+    return buffer.getvalue()
+
+
+def show_preview(df: pd.DataFrame, key: str) -> None:
+    """Render the first rows of a frame, letting the user choose how many.
+
+    Streamlit serializes everything passed to st.dataframe on each rerun, so
+    large frames are capped at PREVIEW_ROWS unless the user asks for more.
+    """
+    if len(df) > PREVIEW_ROWS:
+        n = st.number_input("Preview rows", min_value=1, max_value=len(df),
+                            value=PREVIEW_ROWS, step=100, key=key)
+        df = df.head(n)
+    st.dataframe(df, use_container_width=True)
+
+
+@st.experimental_fragment
+def render_source(name: str, df: pd.DataFrame) -> None:
+    """Render one uploaded source in an expander with a remove button.
+
+    As a fragment, its preview and button only rerun this function rather than
+    the whole script; removing a source still triggers a full rerun.
+    """
+    with st.expander(f"{name} - {len(df)} records"):
+        show_preview(df, key=f"preview_source_{name}")
+        if st.button(f"Remove {name}", key=f"remove_{name}"):
+            del st.session_state['uploaded_files'][name]
+            st.rerun()
+
 
 st.set_page_config(page_title="Employee Compensation Calculator", layout="wide")
 st.title("Employee Compensation Calculator")
@@ -28,68 +205,50 @@ with tab1:
     if uploaded_file is not None and st.button("Add to Analysis"):
         st.success(f"File '{uploaded_file.name}' successfully uploaded as '{source_name}'!")
         
-        # Read the file based on its extension
+        # Read the file based on its extension (cached on the file contents)
         file_extension = os.path.splitext(uploaded_file.name)[1].lower()
-        
-        if file_extension == ".csv":
-            df = pd.read_csv(uploaded_file)
-        else:  # Excel file
-            df = pd.read_excel(uploaded_file)
-            
-        # Process numeric columns
-        numeric_columns = [
-            'Base Salary', 'Annual Bonus', 'Benefits', 
-            'Stock Options', 'Retirement Contribution', 'Total Compensation'
-        ]
-        
-        for col in df.columns:
-            if any(numeric_name in col for numeric_name in numeric_columns):
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-                df[col] = df[col].fillna(0)
+        df = load_df(uploaded_file, file_extension)
         
         # Add to our collection
         st.session_state['uploaded_files'][source_name] = df
         
         # Display the data
         st.subheader(f"Preview: {source_name}")
-        st.dataframe(df)
+        # Fixed-size preview: this branch only renders on the button click, so an
+        # interactive row count here would vanish on the next rerun
+        st.dataframe(df.head(PREVIEW_ROWS), use_container_width=True)
         
         # Show basic statistics
         if df is not None and not df.empty:
             st.write(f"Number of employees: {len(df)}")
             
             # Find numeric columns that might be compensation
-            comp_cols = [col for col in df.columns if any(term in col for term in ['Salary', 'Bonus', 'Benefits', 'Stock', 'Retirement', 'Compensation'])]
+            comp_cols = matching_columns(df)
             if comp_cols:
                 comp_cols_numeric = [col for col in comp_cols if pd.api.types.is_numeric_dtype(df[col])]
                 if comp_cols_numeric:
-                    comp_sum = df[comp_cols_numeric].sum().sum()
+                    # Keyword columns load_df does not coerce (e.g. "Bonus Target") may
+                    # hold nulls; accumulate in float64 and skip them
+                    comp_sum = np.nansum(df[comp_cols_numeric].to_numpy(dtype=np.float64, na_value=np.nan))
                     st.write(f"Sum of all compensation values: ${comp_sum:,.2f}")
     
     # Display all uploaded files
     if st.session_state['uploaded_files']:
         st.subheader("Uploaded Sources")
         for name, df in st.session_state['uploaded_files'].items():
-            with st.expander(f"{name} - {len(df)} records"):
-                st.dataframe(df)
-                if st.button(f"Remove {name}", key=f"remove_{name}"):
-                    del st.session_state['uploaded_files'][name]
-                    st.experimental_rerun()
+            render_source(name, df)
         
         # Create combined dataframe
         if len(st.session_state['uploaded_files']) > 0:
             if st.button("Combine All Sources for Analysis"):
-                dfs = list(st.session_state['uploaded_files'].values())
-                # Check column compatibility
-                all_columns = set(dfs[0].columns)
-                for df in dfs[1:]:
-                    if set(df.columns) != all_columns:
-                        st.warning("Not all datasets have the same columns. Using only common columns.")
-                        all_columns = all_columns.intersection(set(df.columns))
-                
-                # Filter to common columns before concatenating
-                dfs_filtered = [df[list(all_columns)] for df in dfs]
-                combined = pd.concat(dfs_filtered, ignore_index=True)
+                dfs = tuple(st.session_state['uploaded_files'].values())
+                if len(dfs) == 1:
+                    # Nothing to align: analyse the single source directly
+                    combined, mismatched = dfs[0], False
+                else:
+                    combined, mismatched = combine_sources(dfs)
+                if mismatched:
+                    st.warning("Not all datasets have the same columns. Using only common columns.")
                 st.session_state['combined_df'] = combined
                 st.success(f"Combined {len(dfs)} sources with {len(combined)} total records!")
 
@@ -107,15 +266,13 @@ with tab2:
             st.warning("Please combine your uploaded sources in the 'File Upload' tab first.")
     else:
         st.subheader("Combined Data Preview")
-        st.dataframe(combined_df)
+        show_preview(combined_df, key="preview_combined")
         
         # List all columns for the user to select
         st.subheader("Select Compensation Columns")
         
         # Suggest columns based on names
-        comp_columns = [col for col in combined_df.columns if any(
-            term in str(col) for term in ['Salary', 'Bonus', 'Benefits', 'Stock', 'Retirement', 'Compensation']
-        )]
+        comp_columns = matching_columns(combined_df)
         
         # Let the user select compensation columns
         selected_columns = st.multiselect(
@@ -125,22 +282,27 @@ with tab2:
         )
         
         if selected_columns:
-            # Make a copy to avoid modifying the original
-            calc_df = combined_df.copy()
+            # Shallow copy: columns are only ever replaced below, never modified in
+            # place, so the untouched columns can share memory with the original
+            calc_df = combined_df.copy(deep=False)
             
-            # Ensure all selected columns are numeric
-            for col in selected_columns:
-                if not pd.api.types.is_numeric_dtype(calc_df[col]):
-                    st.warning(f"Converting column '{col}' to numeric. Original data may not be fully numeric.")
-                    # Clean the column to ensure successful conversion
-                    calc_df[col] = calc_df[col].astype(str).str.replace(r'[^\d.]', '', regex=True)
-                
-                calc_df[col] = pd.to_numeric(calc_df[col], errors='coerce')
-                calc_df[col] = calc_df[col].fillna(0)
+            # Ensure all selected columns are numeric; only text columns need parsing
+            need = [col for col in selected_columns if not pd.api.types.is_numeric_dtype(calc_df[col])]
+            for col in need:
+                st.warning(f"Converting column '{col}' to numeric. Original data may not be fully numeric.")
+            if need:
+                # Clean the columns to ensure successful conversion
+                calc_df[need] = calc_df[need].apply(to_amounts)
             
-            # Calculate total compensation
-            calc_df['Calculated Total Compensation'] = calc_df[selected_columns].sum(axis=1)
-            total_comp = calc_df['Calculated Total Compensation'].sum()
+            # Materialize the selected columns once as a float64 block, missing values
+            # counted as 0, and derive both the per-employee and the per-component
+            # totals from it
+            block = calc_df[selected_columns].to_numpy(dtype=np.float64, na_value=0.0)
+            col_totals = block.sum(axis=0)
+            calc_df['Calculated Total Compensation'] = block.sum(axis=1)
+            # The grand total is the sum of the component totals; no need to rescan
+            # the per-employee column
+            total_comp = col_totals.sum()
             
             # Display results with improved formatting
             st.subheader("Compensation Analysis")
@@ -153,9 +315,9 @@ with tab2:
             )
             
             if display_cols:
-                st.dataframe(calc_df[display_cols])
+                show_preview(calc_df[display_cols], key="preview_results")
             else:
-                st.dataframe(calc_df)
+                show_preview(calc_df, key="preview_results")
             
             # Summary statistics
             col1, col2, col3 = st.columns(3)
@@ -174,10 +336,10 @@ with tab2:
             # Optional: Add visualization
             st.subheader("Compensation Distribution")
             
-            # Prepare data for chart (sum by component)
+            # Prepare data for chart (sum by component, already computed above)
             chart_data = pd.DataFrame({
                 'Component': list(selected_columns) + ['Total'],
-                'Amount': [calc_df[col].sum() for col in selected_columns] + [total_comp]
+                'Amount': np.append(col_totals, total_comp)
             })
             
             # Display the data for the chart
@@ -186,16 +348,31 @@ with tab2:
             # Department-based analysis if Department column exists
             if 'Department' in calc_df.columns:
                 st.subheader("Compensation by Department")
-                dept_data = calc_df.groupby('Department')['Calculated Total Compensation'].agg(['sum', 'mean', 'count'])
-                dept_data.columns = ['Total Compensation', 'Average Compensation', 'Employee Count']
-                dept_data = dept_data.sort_values('Total Compensation', ascending=False)
+                # Group once for sum and count; the mean follows from those two
+                dept_groups = calc_df.groupby('Department', sort=False, observed=True)['Calculated Total Compensation']
+                dept_data = dept_groups.agg(**{'Total Compensation': 'sum', 'Employee Count': 'count'})
+                dept_data.insert(1, 'Average Compensation', dept_data['Total Compensation'] / dept_data['Employee Count'])
+                if st.checkbox("Show all departments"):
+                    dept_data = dept_data.sort_values('Total Compensation', ascending=False)
+                else:
+                    # Partial sort: only the top departments are displayed
+                    top_n = st.slider("Top N departments", 5, 100, 20)
+                    dept_data = dept_data.nlargest(top_n, 'Total Compensation')
                 st.dataframe(dept_data)
                 
             # Download processed data
-            csv = calc_df.to_csv(index=False)
-            st.download_button(
-                label="Download Combined Data",
-                data=csv,
-                file_name="combined_compensation_data.csv",
-                mime="text/csv"
-            )
\ No newline at end of file
+            dl_col1, dl_col2 = st.columns(2)
+            with dl_col1:
+                st.download_button(
+                    label="Download Combined Data",
+                    data=to_csv_bytes(calc_df),
+                    file_name="combined_compensation_data.csv",
+                    mime="text/csv"
+                )
+            with dl_col2:
+                st.download_button(
+                    label="Download Combined Data (Parquet)",
+                    data=to_parquet_bytes(calc_df),
+                    file_name="combined_compensation_data.parquet",
+                    mime="application/vnd.apache.parquet"
+                )